@@ -2,14 +2,23 @@
 """
 MQTT to Arduino Serial Bridge
 Subscribes to pillnow/*/cmd MQTT topics and forwards alert commands to Arduino via Serial
+
+All bridge logic runs on a single asyncio event loop; paho's network thread
+(client.loop_start) only hands parsed messages over to that loop.
 """
 import paho.mqtt.client as mqtt
+import asyncio
+import http.client
 import os
-import serial
-import json
+import serial_asyncio
+from serial.tools import list_ports
+import orjson
+import re
+import logging
 import sys
-import time
 import threading
+import time
+import urllib.parse
 
 # Configuration
 MQTT_BROKER = "127.0.0.1"  # Local Mosquitto broker
@@ -17,45 +26,81 @@ MQTT_PORT = 1883
 MQTT_TOPIC = "pillnow/+/cmd"  # Subscribe to all container commands
 ARDUINO_SERIAL_PORT = "/dev/tty.usbmodem*"  # Change to your Arduino's serial port
 ARDUINO_BAUD = 9600
+BACKEND_HTTP = os.environ.get('BACKEND_HTTP', 'http://127.0.0.1:5001')
+BACKEND_TIMEOUT_SECONDS = 8
+LOG_LEVEL = os.environ.get('BRIDGE_LOG_LEVEL', 'INFO').upper()
+
+logger = logging.getLogger("arduino_bridge")
+
+# USB vendor IDs of Arduino boards and the USB-serial chips used by clones
+ARDUINO_USB_VIDS = {
+    0x2341,  # Arduino
+    0x2A03,  # Arduino (arduino.org)
+    0x1A86,  # CH340/CH341 (most clones)
+    0x0403,  # FTDI
+    0x10C4,  # Silicon Labs CP210x
+}
 
-# Try common serial ports
-SERIAL_PORTS = [
-    "/dev/cu.usbmodem*",  # macOS write port (preferred)
-    "/dev/tty.usbmodem*",  # macOS read port
-    "/dev/cu.usbserial*",  # macOS write port (alternative)
-    "/dev/tty.usbserial*",  # macOS read port (alternative)
-    "/dev/ttyUSB0",  # Linux
-    "/dev/ttyACM0",  # Linux
-    "COM3",  # Windows
-    "COM4",  # Windows
-]
-
-arduino_serial = None
-arduino_lock = threading.Lock()
+# Serial stream pair (asyncio.StreamReader / asyncio.StreamWriter) while connected.
+# Only touched from the event loop, so no lock is needed.
+arduino_reader = None
+arduino_writer = None
+# Set while the serial stream is open so the reader can sleep until a (re)connect.
+# Created in run_bridge with the other loop-bound objects.
+arduino_ready = None
 last_connect_attempt = 0
 CONNECT_RETRY_SECONDS = 5
+# Port of the last successful connection; tried before rescanning
+_last_good_port = None
+
+# Outbound command batching: commands queued within this window go out in one write
+OUTBOUND_BATCH_WINDOW = 0.005  # seconds
+OUTBOUND_BATCH_MAX_COMMANDS = 16
+OUTBOUND_BATCH_MAX_BYTES = 1024
+
+# ALARM_STOPPED line from the sketch, optionally followed by the container ("ALARM_STOPPED C2").
+# Matched against the raw serial bytes so lines don't need decoding/upper-casing first.
+_ALARM_STOPPED_RE = re.compile(rb'ALARM_STOPPED(?:.*?C(\d+))?', re.IGNORECASE)
+# Container number in MQTT payloads ("container2" -> "2")
+_CONTAINER_NUM_RE = re.compile(r'\d+')
+
+# Set in run_bridge(); used by paho callbacks to hand work to the event loop
+_event_loop = None
+_mqtt_queue = None
+_outbound_queue = None
+_stopped = None
 
 def find_arduino_port():
     """Try to find Arduino serial port"""
-    import glob
-    for pattern in SERIAL_PORTS:
-        if '*' in pattern:
-            ports = glob.glob(pattern)
-            if ports:
-                return ports[0]
-        else:
-            try:
-                ser = serial.Serial(pattern, ARDUINO_BAUD, timeout=1)
-                ser.close()
-                return pattern
-            except:
-                continue
+    # Fast path: reuse the port that worked last time if it still exists
+    if _last_good_port and os.path.exists(_last_good_port):
+        return _last_good_port
+    # Single enumeration of the OS port list, matched on USB vendor ID
+    for port in list_ports.comports():
+        if port.vid in ARDUINO_USB_VIDS:
+            return port.device
     return None
 
-def connect_arduino():
+def arduino_connected():
+    """True while the serial stream is open"""
+    return arduino_writer is not None and not arduino_writer.is_closing()
+
+def close_arduino():
+    """Close the serial stream (if any) and mark Arduino as disconnected"""
+    global arduino_reader, arduino_writer
+    try:
+        if arduino_writer is not None:
+            arduino_writer.close()
+    except Exception:
+        pass
+    arduino_reader = None
+    arduino_writer = None
+    arduino_ready.clear()
+
+async def connect_arduino():
     """Connect to Arduino via Serial"""
-    global arduino_serial
-    global last_connect_attempt
+    global arduino_reader, arduino_writer
+    global last_connect_attempt, _last_good_port
 
     # Rate limit connection attempts (avoids log spam + port hammering)
     now = time.time()
@@ -65,206 +110,296 @@ def connect_arduino():
 
     port = find_arduino_port()
     if not port:
-        print("⚠️  Arduino not found. Alert commands will be logged but not sent.", flush=True)
-        print("   Connect Arduino and update SERIAL_PORTS in this script.", flush=True)
+        logger.warning("⚠️  Arduino not found. Alert commands will be logged but not sent.")
+        logger.warning("   Connect Arduino and add its USB vendor ID to ARDUINO_USB_VIDS in this script.")
         return False
-    
+
     try:
         # Close any existing handle first
+        close_arduino()
+
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=port, baudrate=ARDUINO_BAUD
+        )
         try:
-            if arduino_serial and arduino_serial.is_open:
-                arduino_serial.close()
-        except Exception:
-            pass
-
-        arduino_serial = serial.Serial(port, ARDUINO_BAUD, timeout=1)
-        time.sleep(2)  # Wait for Arduino to reset
-        print(f"✅ Connected to Arduino on {port}", flush=True)
+            await asyncio.sleep(2)  # Wait for Arduino to reset
+        except BaseException:
+            writer.close()
+            raise
+        # Publish only after the reset, so nothing is written while the bootloader runs
+        arduino_reader, arduino_writer = reader, writer
+        _last_good_port = port
+        arduino_ready.set()
+        logger.info("✅ Connected to Arduino on %s", port)
         return True
     except Exception as e:
         error_msg = str(e)
         if "Resource busy" in error_msg or "could not open port" in error_msg:
-            print(f"⚠️  Arduino port is busy (Serial Monitor may be open): {e}", flush=True)
-            print(f"   Please close Arduino Serial Monitor (or any app using the port).", flush=True)
-            print(f"   💡 This bridge will auto-retry connecting every {CONNECT_RETRY_SECONDS}s.", flush=True)
+            logger.warning("⚠️  Arduino port is busy (Serial Monitor may be open): %s", e)
+            logger.warning("   Please close Arduino Serial Monitor (or any app using the port).")
+            logger.warning("   💡 This bridge will auto-retry connecting every %ss.", CONNECT_RETRY_SECONDS)
         else:
-            print(f"❌ Failed to connect to Arduino: {e}", flush=True)
+            logger.error("❌ Failed to connect to Arduino: %s", e)
+        _last_good_port = None
         return False
 
-def send_to_arduino(command):
-    """Send command to Arduino via Serial"""
+def queue_for_arduino(command):
+    """Queue an encoded, newline-terminated command; arduino_writer_loop sends it with the next batch"""
+    _outbound_queue.put_nowait(command)
+
+async def arduino_writer_loop():
+    """Drain queued commands and send each batch to the Arduino in a single write."""
+    carry = None
+    while True:
+        batch = [carry if carry is not None else await _outbound_queue.get()]
+        carry = None
+        # Give commands arriving in the same burst a moment to join this batch
+        await asyncio.sleep(OUTBOUND_BATCH_WINDOW)
+        size = len(batch[0])
+        while len(batch) < OUTBOUND_BATCH_MAX_COMMANDS and not _outbound_queue.empty():
+            command = _outbound_queue.get_nowait()
+            if size + len(command) > OUTBOUND_BATCH_MAX_BYTES:
+                carry = command  # Starts the next batch
+                break
+            batch.append(command)
+            size += len(command)
+        try:
+            await send_to_arduino(batch)
+        except Exception as e:
+            logger.error("❌ Failed to send to Arduino: %s", e)
+
+async def send_to_arduino(commands):
+    """Send a batch of commands to Arduino via Serial"""
+    global _last_good_port
     # Ensure we have a connection (auto-retry)
-    with arduino_lock:
-        if not (arduino_serial and arduino_serial.is_open):
-            connect_arduino()
+    if not arduino_connected():
+        await connect_arduino()
 
-    if arduino_serial and arduino_serial.is_open:
+    if arduino_connected():
         try:
-            # Ensure command ends with newline
-            cmd_with_newline = f"{command}\n"
-            # Write in chunks to ensure reliable transmission for long commands
-            data = cmd_with_newline.encode('utf-8')
-            chunk_size = 64  # Send in 64-byte chunks
-            for i in range(0, len(data), chunk_size):
-                chunk = data[i:i+chunk_size]
-                arduino_serial.write(chunk)
-                arduino_serial.flush()  # Flush after each chunk
-                time.sleep(0.01)  # Small delay between chunks
-            print(f"📤 Sent to Arduino ({len(data)} bytes): {command[:80]}...", flush=True)
+            # Commands are already encoded and newline-terminated
+            data = b"".join(commands)
+            # Single write: the OS/USB-CDC driver packetizes into 64-byte frames itself,
+            # so no per-chunk flush or sleep is needed (they only added latency)
+            arduino_writer.write(data)
+            await arduino_writer.drain()
+            if logger.isEnabledFor(logging.DEBUG):
+                for command in commands:
+                    logger.debug("📤 Sent to Arduino: %s", command[:80].decode('utf-8', errors='replace').rstrip())
+            logger.info("📤 Batch of %d command(s) sent to Arduino (%d bytes)", len(commands), len(data))
             return True
         except Exception as e:
-            print(f"❌ Failed to send to Arduino: {e}", flush=True)
-            # Mark as disconnected; will reconnect on next send
-            try:
-                with arduino_lock:
-                    if arduino_serial:
-                        arduino_serial.close()
-            except Exception:
-                pass
+            logger.error("❌ Failed to send to Arduino: %s", e)
+            # Mark as disconnected and rescan ports; will reconnect on next send
+            _last_good_port = None
+            close_arduino()
             return False
     else:
-        print(f"⚠️  Arduino not connected. Would send: {command[:100]}...", flush=True)
-        print(f"   💡 TIP: Close Arduino Serial Monitor. This bridge will auto-retry.", flush=True)
+        for command in commands:
+            logger.warning("⚠️  Arduino not connected. Would send: %s", command[:100].decode('utf-8', errors='replace').rstrip())
+        logger.warning("   💡 TIP: Close Arduino Serial Monitor. This bridge will auto-retry.")
         return False
 
-def arduino_reconnect_loop():
-    """Background loop to reconnect Arduino when port becomes available."""
+async def arduino_reconnect_loop():
+    """Background task to reconnect Arduino when port becomes available."""
     while True:
         try:
-            with arduino_lock:
-                if not (arduino_serial and arduino_serial.is_open):
-                    connect_arduino()
+            if not arduino_connected():
+                await connect_arduino()
         except Exception as e:
-            print(f"⚠️  Arduino reconnect loop error: {e}", flush=True)
-        time.sleep(CONNECT_RETRY_SECONDS)
+            logger.warning("⚠️  Arduino reconnect loop error: %s", e)
+        await asyncio.sleep(CONNECT_RETRY_SECONDS)
+
+def _request_stop(exit_code):
+    """Resolve _stopped once (runs on the event loop); paho may report several failed connects"""
+    if not _stopped.done():
+        _stopped.set_result(exit_code)
 
 def on_connect(client, userdata, flags, rc):
-    """MQTT connection callback"""
-    sys.stdout.flush()
+    """MQTT connection callback (runs on paho's network thread)"""
     if rc == 0:
-        print(f"✅ Connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}", flush=True)
-        print(f"📡 Subscribing to {MQTT_TOPIC}...", flush=True)
+        logger.info("✅ Connected to MQTT broker at %s:%s", MQTT_BROKER, MQTT_PORT)
+        logger.info("📡 Subscribing to %s...", MQTT_TOPIC)
         result = client.subscribe(MQTT_TOPIC)
-        print(f"📡 Subscribe result: {result}", flush=True)
-        print(f"📡 Successfully subscribed to {MQTT_TOPIC}", flush=True)
+        logger.debug("📡 Subscribe result: %s", result)
+        logger.info("📡 Successfully subscribed to %s", MQTT_TOPIC)
     else:
-        print(f"❌ Failed to connect to MQTT broker. Return code: {rc}", flush=True)
-        sys.exit(1)
+        logger.error("❌ Failed to connect to MQTT broker. Return code: %s", rc)
+        # sys.exit() would only end paho's thread; ask the event loop to stop instead
+        _event_loop.call_soon_threadsafe(_request_stop, 1)
 
 def on_message(client, userdata, msg):
-    """MQTT message callback"""
-    try:
-        print(f"📨 Received MQTT message on topic: {msg.topic}", flush=True)
-        print(f"   Payload: {msg.payload.decode()}", flush=True)
-        payload = json.loads(msg.payload.decode())
-        topic = msg.topic
-        
-        action = payload.get("action")
-
-        # Alert action from verifier/backend (pill mismatch, etc.)
-        if action == "alert":
-            print(f"🚨 Alert received from {topic}")
-            print(f"   Reason: {payload.get('reason', 'unknown')}")
-            container = payload.get('container', 'unknown')
-            print(f"   Container: {container}")
-            print(f"   Expected: {payload.get('expected', {})}")
-            print(f"   Detected: {payload.get('detected', [])}")
-            
-            # Extract container number from container string (e.g., "container2" -> "2")
-            container_num = "0"  # Default to 0 if can't parse
-            try:
-                if container and isinstance(container, str):
-                    # Extract digits from container string
-                    container_num = ''.join([c for c in container if c.isdigit()])
-                    if not container_num:
-                        container_num = "0"
-                elif isinstance(container, int):
-                    container_num = str(container)
-            except Exception as e:
-                print(f"⚠️ Error parsing container number: {e}")
-                container_num = "0"
-            
-            # Send PILLALERT command to Arduino with container number
-            # Format: PILLALERT C<number> (e.g., "PILLALERT C2")
-            cmd = f"PILLALERT C{container_num}"
-            print(f"📤 Sending to Arduino: {cmd}")
-            send_to_arduino(cmd)
-
-        # Alarm trigger action (for app modal via Bluetooth)
-        elif action == "alarm_triggered":
-            container = payload.get("container", "container1")
-            date_str = payload.get("date", "")  # optional YYYY-MM-DD
-            time_str = payload.get("time", "00:00")
-            # Expect container like "container1" → extract digit(s)
-            try:
-                container_num = ''.join([c for c in str(container) if c.isdigit()])
-                if not container_num:
-                    container_num = "1"
-            except Exception:
-                container_num = "1"
-            # Include date to help the app match the correct cloud schedule (prevents wrong/late status updates)
-            # Format supported by Arduino sketch (we parse last HH:MM token):
-            #   ALARM_TRIGGERED C2 2025-12-14 23:07
-            cmd = f"ALARM_TRIGGERED C{container_num} {date_str} {time_str}" if date_str else f"ALARM_TRIGGERED C{container_num} {time_str}"
-            print(f"⏰ Alarm trigger -> sending to Arduino/Bluetooth: {cmd}")
-            send_to_arduino(cmd)
-
-        # SMS sending action
-        elif action == "send_sms":
-            phone = payload.get("phone", "")
-            message = payload.get("message", "")
-            print(f"📱 SMS action detected!", flush=True)
-            print(f"   Phone: {phone}", flush=True)
-            print(f"   Message length: {len(message) if message else 0}", flush=True)
-            if phone and message:
-                print(f"📱 SMS request received from {topic}", flush=True)
-                print(f"   Phone: {phone}", flush=True)
-                print(f"   Message: {message[:50]}...", flush=True)
-                
-                # Send SENDSMS command to Arduino: SENDSMS <phone> <message>
-                command = f"SENDSMS {phone} {message}"
-                print(f"📤 Sending command to Arduino: {command[:80]}...", flush=True)
-                result = send_to_arduino(command)
-                if result:
-                    print(f"✅ Command sent to Arduino successfully", flush=True)
-                else:
-                    print(f"❌ Failed to send command to Arduino", flush=True)
+    """MQTT message callback (runs on paho's network thread)
+
+    Only hands the raw topic/payload to the event loop so paho's network thread
+    returns immediately; parsing and routing happen in mqtt_message_loop().
+    """
+    # Cheap bytes prefilter: messages that can't carry a handled action are never parsed
+    payload = msg.payload
+    if not any(tag in payload for tag in _ACTION_TAGS):
+        return
+    _event_loop.call_soon_threadsafe(_mqtt_queue.put_nowait, (msg.topic, payload))
+
+async def mqtt_message_loop():
+    """Parse and route MQTT messages queued by on_message, one at a time."""
+    while True:
+        topic, raw_payload = await _mqtt_queue.get()
+        try:
+            logger.debug("📨 Received MQTT message on topic: %s", topic)
+            logger.debug("   Payload: %r", raw_payload)
+            payload = orjson.loads(raw_payload)  # orjson parses the bytes payload directly
+            handle_command(topic, payload)
+        except Exception as e:
+            logger.error("❌ Error processing MQTT message: %s", e)
+
+def encode_command(command):
+    """Encode a serial command as one newline-terminated line"""
+    return f"{command}\n".encode('utf-8')
+
+def build_alert(topic, payload):
+    """Alert action from verifier/backend (pill mismatch, etc.) -> PILLALERT C<number>"""
+    container = payload.get('container', 'unknown')
+    logger.info("🚨 Alert received from %s (reason: %s, container: %s)",
+                topic, payload.get('reason', 'unknown'), container)
+    logger.debug("   Expected: %s", payload.get('expected', {}))
+    logger.debug("   Detected: %s", payload.get('detected', []))
+
+    # Extract container number from container string (e.g., "container2" -> "2")
+    container_num = "0"  # Default to 0 if can't parse
+    if container and isinstance(container, str):
+        m = _CONTAINER_NUM_RE.search(container)
+        if m:
+            container_num = m.group(0)
+    elif isinstance(container, int):
+        container_num = str(container)
+
+    # Format: PILLALERT C<number> (e.g., "PILLALERT C2")
+    cmd = f"PILLALERT C{container_num}"
+    logger.info("📤 Sending to Arduino: %s", cmd)
+    return encode_command(cmd)
+
+def build_alarm_triggered(topic, payload):
+    """Alarm trigger action (for app modal via Bluetooth) -> ALARM_TRIGGERED C<number> [date] HH:MM"""
+    container = payload.get("container", "container1")
+    date_str = payload.get("date", "")  # optional YYYY-MM-DD
+    time_str = payload.get("time", "00:00")
+    # Expect container like "container1" → extract digit(s)
+    m = _CONTAINER_NUM_RE.search(str(container))
+    container_num = m.group(0) if m else "1"
+    # Include date to help the app match the correct cloud schedule (prevents wrong/late status updates)
+    # Format supported by Arduino sketch (we parse last HH:MM token):
+    #   ALARM_TRIGGERED C2 2025-12-14 23:07
+    cmd = f"ALARM_TRIGGERED C{container_num} {date_str} {time_str}" if date_str else f"ALARM_TRIGGERED C{container_num} {time_str}"
+    logger.info("⏰ Alarm trigger -> sending to Arduino/Bluetooth: %s", cmd)
+    return encode_command(cmd)
+
+def build_send_sms(topic, payload):
+    """SMS sending action -> SENDSMS <phone> <message>; None if the payload is incomplete"""
+    phone = payload.get("phone", "")
+    message = payload.get("message", "")
+    if not (phone and message):
+        logger.warning("⚠️  Invalid SMS payload: missing phone or message")
+        logger.warning("   Phone present: %s, Message present: %s", bool(phone), bool(message))
+        return None
+    logger.info("📱 SMS request received from %s (phone: %s, message length: %d)", topic, phone, len(message))
+    logger.debug("   Message: %s...", message[:50])
+    return encode_command(f"SENDSMS {phone} {message}")
+
+# MQTT "action" -> builder returning the encoded serial command (or None to drop the message)
+_COMMAND_BUILDERS = {
+    "alert": build_alert,
+    "alarm_triggered": build_alarm_triggered,
+    "send_sms": build_send_sms,
+}
+# Quoted action names as they appear in the JSON payload, for on_message's prefilter
+_ACTION_TAGS = tuple(f'"{action}"'.encode() for action in _COMMAND_BUILDERS)
+
+def handle_command(topic, payload):
+    """Route a parsed MQTT command to the Arduino outbound queue"""
+    builder = _COMMAND_BUILDERS.get(payload.get("action"))
+    if builder is None:
+        logger.debug("📨 Message from %s: %s", topic, payload)
+        return
+    command = builder(topic, payload)
+    if command:
+        queue_for_arduino(command)
+
+_backend_url = urllib.parse.urlsplit(BACKEND_HTTP)
+# Keep-alive connection per worker thread (http.client connections aren't thread-safe)
+_backend_local = threading.local()
+
+def backend_connection():
+    """Return this thread's persistent connection to the backend, opening it if needed"""
+    conn = getattr(_backend_local, "conn", None)
+    if conn is None:
+        conn_cls = http.client.HTTPSConnection if _backend_url.scheme == "https" else http.client.HTTPConnection
+        conn = conn_cls(_backend_url.hostname, _backend_url.port, timeout=BACKEND_TIMEOUT_SECONDS)
+        _backend_local.conn = conn
+    return conn
+
+def close_backend_connection():
+    """Drop this thread's backend connection; the next call reconnects"""
+    conn = getattr(_backend_local, "conn", None)
+    _backend_local.conn = None
+    if conn is not None:
+        conn.close()
+
+def notify_alarm_stopped(container_id):
+    """POST /alarm/stopped/<container_id> to the backend (blocking; run in a worker thread)"""
+    path = f"{_backend_url.path.rstrip('/')}/alarm/stopped/{container_id}"
+    body = orjson.dumps({})
+    headers = {"Content-Type": "application/json"}
+    for attempt in range(2):
+        try:
+            conn = backend_connection()
+            conn.request("POST", path, body=body, headers=headers)
+            resp = conn.getresponse()
+            text = resp.read().decode('utf-8')
+            if resp.status >= 400:
+                logger.error("❌ Failed to call backend /alarm/stopped: HTTP %s %s", resp.status, text)
             else:
-                print(f"⚠️  Invalid SMS payload: missing phone or message", flush=True)
-                print(f"   Phone present: {bool(phone)}, Message present: {bool(message)}", flush=True)
-        else:
-            print(f"📨 Message from {topic}: {payload}")
-    except Exception as e:
-        print(f"❌ Error processing MQTT message: {e}")
+                logger.info("📤 Backend /alarm/stopped response: %s", text)
+            return
+        except ConnectionError as e:
+            # The backend closed an idle keep-alive connection; retry once on a fresh one
+            close_backend_connection()
+            if attempt:
+                logger.error("❌ Failed to call backend /alarm/stopped: %s", e)
+        except Exception as e:
+            close_backend_connection()
+            logger.error("❌ Failed to call backend /alarm/stopped: %s", e)
+            return
 
-def serial_read_loop():
+async def serial_read_loop():
     """Read lines from Arduino Serial and handle ALARM_STOPPED events."""
-    global arduino_serial
     last_stop_ts = {}
-    BACKEND_HTTP = os.environ.get('BACKEND_HTTP', 'http://127.0.0.1:5001')
 
     while True:
         try:
-            if not (arduino_serial and arduino_serial.is_open):
-                time.sleep(1)
+            if not arduino_connected():
+                # Wake up on the next successful connect instead of polling
+                await arduino_ready.wait()
                 continue
             try:
-                line = arduino_serial.readline().decode('utf-8', errors='ignore').strip()
+                # Suspends until a full line arrives (no polling)
+                raw = await arduino_reader.readline()
             except Exception:
-                line = ""
-            if not line:
-                time.sleep(0.1)
+                raw = b""
+            if not raw:
+                # EOF or read error: port went away, let the reconnect task reopen it
+                close_arduino()
+                continue
+            raw = raw.strip()
+            if not raw:
                 continue
-            print(f"📟 Serial <- {line}", flush=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📟 Serial <- %s", raw.decode('utf-8', errors='ignore'))
 
             # Detect ALARM_STOPPED (we added a short tag from the sketch)
-            if 'ALARM_STOPPED' in line.upper():
-                # Try to extract container number (C<number>)
-                container_num = None
-                import re
-                m = re.search(r'C(\d+)', line.upper())
-                if m:
-                    container_num = int(m.group(1))
+            m = _ALARM_STOPPED_RE.search(raw)
+            if m:
+                # Container number (C<number>) if the sketch sent one
+                container_num = int(m.group(1)) if m.group(1) else None
                 if not container_num:
                     # fallback to 1
                     container_num = 1
@@ -273,64 +408,74 @@ def serial_read_loop():
                 now = time.time()
                 last = last_stop_ts.get(container_id, 0)
                 if now - last < 5:
-                    print(f"⚠️  Ignoring duplicate ALARM_STOPPED for {container_id} (throttled)", flush=True)
+                    logger.warning("⚠️  Ignoring duplicate ALARM_STOPPED for %s (throttled)", container_id)
                     continue
                 last_stop_ts[container_id] = now
 
-                print(f"📣 Detected ALARM_STOPPED for {container_id}, calling backend for post-capture...", flush=True)
-                try:
-                    import urllib.request, json
-                    url = f"{BACKEND_HTTP}/alarm/stopped/{container_id}"
-                    data = json.dumps({}).encode('utf-8')
-                    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-                    with urllib.request.urlopen(req, timeout=8) as resp:
-                        text = resp.read().decode('utf-8')
-                        print(f"📤 Backend /alarm/stopped response: {text}", flush=True)
-                except Exception as e:
-                    print(f"❌ Failed to call backend /alarm/stopped: {e}", flush=True)
+                logger.info("📣 Detected ALARM_STOPPED for %s, calling backend for post-capture...", container_id)
+                await asyncio.to_thread(notify_alarm_stopped, container_id)
         except Exception as e:
-            print(f"⚠️ Serial read loop error: {e}", flush=True)
-            time.sleep(1)
+            logger.warning("⚠️ Serial read loop error: %s", e)
+            await asyncio.sleep(1)
 
 
-def main():
-    """Main function"""
-    print("🔌 Starting MQTT to Arduino Alert Bridge...", flush=True)
-    sys.stdout.flush()
-    
+async def run_bridge(client):
+    """Run the bridge tasks until interrupted or MQTT connection fails; returns exit code"""
+    global _event_loop, _mqtt_queue, _outbound_queue, _stopped, arduino_ready
+    _event_loop = asyncio.get_running_loop()
+    arduino_ready = asyncio.Event()
+    _mqtt_queue = asyncio.Queue()
+    _outbound_queue = asyncio.Queue()
+    _stopped = _event_loop.create_future()
+
     # Connect to Arduino
-    connect_arduino()
-    # Start reconnect loop so alarms/mismatch resume automatically after closing Serial Monitor
-    t = threading.Thread(target=arduino_reconnect_loop, daemon=True)
-    t.start()
+    await connect_arduino()
+    tasks = [
+        # Reconnect task so alarms/mismatch resume automatically after closing Serial Monitor
+        asyncio.create_task(arduino_reconnect_loop()),
+        # Serial reader that listens for ALARM_STOPPED messages and triggers post-capture
+        asyncio.create_task(serial_read_loop()),
+        asyncio.create_task(mqtt_message_loop()),
+        asyncio.create_task(arduino_writer_loop()),
+    ]
+
+    try:
+        logger.info("🔗 Connecting to MQTT broker at %s:%s...", MQTT_BROKER, MQTT_PORT)
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        logger.info("🔄 Starting MQTT loop...")
+        client.loop_start()
+        return await _stopped
+    finally:
+        client.loop_stop()
+        for task in tasks:
+            task.cancel()
+        close_arduino()
+        client.disconnect()
+
 
-    # Start serial reader thread that listens for ALARM_STOPPED messages and triggers post-capture
-    serial_reader_thread = threading.Thread(target=serial_read_loop, daemon=True)
-    serial_reader_thread.start()
+def main():
+    """Main function"""
+    # Per-message detail (payloads, serial echo) is DEBUG; set BRIDGE_LOG_LEVEL=DEBUG to see it
+    # A typo'd level shouldn't keep the bridge from starting; fall back to INFO
+    log_level_valid = isinstance(getattr(logging, LOG_LEVEL, None), int)
+    logging.basicConfig(level=LOG_LEVEL if log_level_valid else logging.INFO, format="%(message)s", stream=sys.stdout)
+    if not log_level_valid:
+        logger.warning("Unknown BRIDGE_LOG_LEVEL %r - using INFO", LOG_LEVEL)
+    logger.info("🔌 Starting MQTT to Arduino Alert Bridge...")
 
-    sys.stdout.flush()
-    
     # Connect to MQTT
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
-    
+
     try:
-        print(f"🔗 Connecting to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}...", flush=True)
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        print("🔄 Starting MQTT loop...", flush=True)
-        sys.stdout.flush()
-        client.loop_forever()
+        sys.exit(asyncio.run(run_bridge(client)))
     except KeyboardInterrupt:
-        print("\n🛑 Stopping bridge...")
-        if arduino_serial:
-            arduino_serial.close()
-        client.disconnect()
+        logger.info("🛑 Stopping bridge...")
         sys.exit(0)
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.error("❌ Error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
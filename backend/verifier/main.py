@@ -1,44 +1,164 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Any, Dict, List, Optional
-from io import BytesIO
-import json
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import atexit
+import base64
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib.util
+import itertools
+import logging
+import logging.handlers
+import orjson
 import os
+import queue
+import sys
+import threading
 import time
+import traceback
 from pathlib import Path
 
+# Per-request detail (boxes, filtering, pass/fail reasoning) is DEBUG; set VERIFIER_LOG_LEVEL=DEBUG to see it
+LOG_LEVEL = os.environ.get("VERIFIER_LOG_LEVEL", "INFO").upper()
+# A typo'd level shouldn't keep the verifier from starting; fall back to INFO and say so below
+_log_level_valid = isinstance(getattr(logging, LOG_LEVEL, None), int)
+logging.basicConfig(level=LOG_LEVEL if _log_level_valid else logging.INFO, format="%(message)s")
+logger = logging.getLogger("verifier")
+# Request threads only enqueue records; a listener thread does the stderr writes
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener.start()
+atexit.register(_log_listener.stop)
+if not _log_level_valid:
+    logger.warning("Unknown VERIFIER_LOG_LEVEL %r - using INFO", LOG_LEVEL)
+
 # Mock verifier mode flag - when true, skip heavy ML imports and return deterministic responses
 MOCK_VERIFIER = str(os.environ.get('MOCK_VERIFIER', '')).lower() in ('1', 'true', 'yes')
 
 # Conditional heavy imports (skip when MOCK_VERIFIER to make CI lightweight)
 if not MOCK_VERIFIER:
-    from PIL import Image
     import cv2
     import numpy as np
+    import torch
     from ultralytics import YOLO
 else:
     # Provide light fallback types in mock mode
     # Import numpy for type hints even in mock mode
     import numpy as np
-    Image = None
     cv2 = None
+    torch = None
     YOLO = None
 
-app = FastAPI(title="PillNow Verifier", version="0.1.0")
+app = FastAPI(title="PillNow Verifier", version="0.1.0", default_response_class=ORJSONResponse)
+
+# Annotated images are saved to backend/captures (one level up from verifier), shared with server.js
+CAPTURES_DIR = Path(__file__).parent.parent / "captures"
+# Sequence suffix for annotated filenames: concurrent requests can land in the same millisecond
+_annotated_seq = itertools.count()
 
 # Load models on startup
 MODEL_DIR = Path(__file__).parent / "models"
 YOLO_MODEL_PATH = MODEL_DIR / "best_new.pt"
+# TensorRT engine exported from YOLO_MODEL_PATH on first CUDA startup (GPU/driver specific)
+YOLO_ENGINE_PATH = YOLO_MODEL_PATH.with_suffix(".engine")
+# OpenVINO IR exported from YOLO_MODEL_PATH on first CPU-only startup (Ultralytics' export directory names)
+YOLO_OPENVINO_DIR = MODEL_DIR / f"{YOLO_MODEL_PATH.stem}_openvino_model"
+YOLO_OPENVINO_INT8_DIR = MODEL_DIR / f"{YOLO_MODEL_PATH.stem}_int8_openvino_model"
+# Dataset YAML with pill images for INT8 post-training quantization of the OpenVINO model.
+# Unset = FP32 IR; quantizing without representative calibration images costs accuracy.
+OPENVINO_INT8_DATA = os.environ.get("VERIFIER_OPENVINO_INT8_DATA")
 
 yolo_model = None
+# Square model input size; frames are letterboxed to this on the CPU before inference
+YOLO_IMGSZ = 640
+# Inference device/precision, chosen in load_models(): FP16 on CUDA, FP32 on CPU
+yolo_device = "cpu"
+yolo_half = False
+
+# Micro-batching: concurrent /verify requests are coalesced into one model call.
+# A request waits at most INFERENCE_BATCH_WINDOW seconds for others to join its batch.
+INFERENCE_BATCH_WINDOW = float(os.environ.get("VERIFIER_BATCH_WINDOW_MS", "5")) / 1000
+# Also the batch size the TensorRT/OpenVINO exports are built with; delete them to re-export after changing
+INFERENCE_BATCH_MAX_IMAGES = int(os.environ.get("VERIFIER_BATCH_MAX_IMAGES", "8"))
+_inference_queue: Optional[asyncio.Queue] = None
+_inference_task: Optional[asyncio.Task] = None
+# Decode, letterbox and post-processing run on this bounded pool instead of the event loop, so
+# one large upload doesn't stall every other request. Inference itself runs in the batch worker.
+VERIFIER_CPU_WORKERS = int(os.environ.get("VERIFIER_CPU_WORKERS", "4"))
+_cpu_executor = ThreadPoolExecutor(max_workers=VERIFIER_CPU_WORKERS, thread_name_prefix="verify-cpu")
+# Set once startup (model load + warmup) has finished; reported by /ready
+models_ready = False
+
+# Minimum confidence for a detection to count. Applied by the predictor itself (before NMS), so
+# low-confidence boxes never reach the Python post-processing.
+DETECTION_MIN_CONFIDENCE = 0.35
+# Quality filter applied to the predictor's boxes (in original image pixels):
+# very small boxes are likely false positives, and pills are roughly circular/oval, not elongated
+DETECTION_MIN_AREA = 100
+DETECTION_MIN_ASPECT_RATIO = 0.3
+DETECTION_MAX_ASPECT_RATIO = 3.0
+
+def load_tensorrt_engine():
+    """Load the TensorRT FP16 engine, exporting it from the .pt weights if missing or stale.
+
+    Returns None (caller falls back to the PyTorch model) if TensorRT isn't installed or export fails.
+    """
+    if importlib.util.find_spec("tensorrt") is None:
+        logger.info("[Verifier] TensorRT not installed - using PyTorch weights on CUDA")
+        return None
+    try:
+        if not YOLO_ENGINE_PATH.exists() or YOLO_ENGINE_PATH.stat().st_mtime < YOLO_MODEL_PATH.stat().st_mtime:
+            logger.info("[Verifier] Exporting TensorRT FP16 engine to %s (one-time, may take minutes)...", YOLO_ENGINE_PATH)
+            # Dynamic batch axis (up to INFERENCE_BATCH_MAX_IMAGES) so coalesced requests run as one batch
+            YOLO(str(YOLO_MODEL_PATH)).export(format="engine", half=True, imgsz=YOLO_IMGSZ, dynamic=True,
+                                              batch=INFERENCE_BATCH_MAX_IMAGES, workspace=4, device=0)
+        engine = YOLO(str(YOLO_ENGINE_PATH), task="detect")
+        logger.info("[Verifier] ✅ TensorRT engine loaded from %s", YOLO_ENGINE_PATH)
+        return engine
+    except Exception as e:
+        logger.exception("[Verifier] ⚠️ TensorRT engine unavailable (%s) - using PyTorch weights on CUDA", e)
+        return None
+
+def load_openvino_model():
+    """Load the OpenVINO IR for CPU inference, exporting it from the .pt weights if missing or stale.
+
+    Exported with a dynamic batch axis, so Ultralytics compiles it with OpenVINO's throughput hint and
+    runs each coalesced batch through an async infer queue across CPU streams.
+    Returns None (caller falls back to the PyTorch model) if OpenVINO isn't installed or export fails.
+    """
+    if importlib.util.find_spec("openvino") is None:
+        logger.info("[Verifier] OpenVINO not installed - using PyTorch weights on CPU")
+        return None
+    try:
+        int8 = bool(OPENVINO_INT8_DATA)
+        model_dir = YOLO_OPENVINO_INT8_DIR if int8 else YOLO_OPENVINO_DIR
+        ir_path = model_dir / f"{YOLO_MODEL_PATH.stem}.xml"
+        if not ir_path.exists() or ir_path.stat().st_mtime < YOLO_MODEL_PATH.stat().st_mtime:
+            logger.info("[Verifier] Exporting OpenVINO %s model to %s (one-time)...", "INT8" if int8 else "FP32", model_dir)
+            # INT8 halves weight bytes again and uses VNNI int8 dot products; calibrated on OPENVINO_INT8_DATA
+            YOLO(str(YOLO_MODEL_PATH)).export(format="openvino", half=False, int8=int8, data=OPENVINO_INT8_DATA,
+                                              imgsz=YOLO_IMGSZ, dynamic=True, batch=INFERENCE_BATCH_MAX_IMAGES)
+        model = YOLO(str(model_dir), task="detect")
+        logger.info("[Verifier] ✅ OpenVINO model loaded from %s", model_dir)
+        return model
+    except Exception as e:
+        logger.exception("[Verifier] ⚠️ OpenVINO model unavailable (%s) - using PyTorch weights on CPU", e)
+        return None
 
 @app.on_event("startup")
 async def load_models():
     """Load YOLOv8 model on server startup (skipped in MOCK mode)"""
-    global yolo_model
+    global yolo_model, yolo_device, yolo_half, _inference_queue, _inference_task, models_ready
     
-    import sys
     print("[Verifier] Starting YOLO model loading...", flush=True)
     sys.stdout.flush()
     
@@ -47,23 +167,52 @@ async def load_models():
         yolo_model = None
         print("[Verifier] ✅ Server ready (MOCK mode)", flush=True)
         sys.stdout.flush()
+        models_ready = True
         return
 
+    # Created once here rather than on every save_annotated_image() call
+    CAPTURES_DIR.mkdir(exist_ok=True)
+
     try:
         print("[Verifier] Loading YOLO model (this may take 10-30 seconds)...", flush=True)
         sys.stdout.flush()
         # Load YOLOv8 model
         if YOLO_MODEL_PATH.exists():
             print(f"[Verifier] Loading YOLOv8 model from {YOLO_MODEL_PATH}", flush=True)
-            yolo_model = YOLO(str(YOLO_MODEL_PATH))
-            print("[Verifier] ✅ YOLOv8 model loaded successfully", flush=True)
+            # Half precision halves weight/activation bandwidth on GPU with negligible mAP loss
+            if torch.cuda.is_available():
+                yolo_device = 0
+                yolo_half = True
+                # Camera frames have a fixed size, so let cuDNN autotune conv algorithms once per shape
+                torch.backends.cudnn.benchmark = True
+                # TensorRT fuses conv+bn+act layers and uses tensor cores; fall back to .pt if unavailable
+                yolo_model = load_tensorrt_engine()
+            else:
+                # CPU-only host: OpenVINO's multi-stream runtime is much faster than PyTorch on CPU
+                yolo_model = load_openvino_model()
+            if yolo_model is None:
+                yolo_model = YOLO(str(YOLO_MODEL_PATH))
+                if yolo_half:
+                    # PyTorch fallback on CUDA: NHWC convs use tensor cores better in FP16. Fuse conv+bn
+                    # first; the predictor only fuses unfused models, which would rebuild weights as NCHW.
+                    yolo_model.fuse()
+                    yolo_model.model.to(memory_format=torch.channels_last)
+            print(f"[Verifier] ✅ YOLOv8 model loaded successfully (device={yolo_device}, half={yolo_half})", flush=True)
+            # A few dummy passes so the first real request doesn't pay CUDA context creation, cuDNN
+            # autotuning / TensorRT context setup and Ultralytics' predictor setup
+            print("[Verifier] Warming up model...", flush=True)
+            warmup_frame = np.full((YOLO_IMGSZ, YOLO_IMGSZ, 3), 114, dtype=np.uint8)
+            for _ in range(3):
+                await run_in_threadpool(predict_batch, [warmup_frame])
+            print("[Verifier] ✅ Model warmed up", flush=True)
+            models_ready = True
+            _inference_queue = asyncio.Queue()
+            _inference_task = asyncio.create_task(inference_batch_worker())
         else:
             print(f"[Verifier] ⚠️ Warning: YOLOv8 model not found at {YOLO_MODEL_PATH}", flush=True)
             yolo_model = None
             
     except Exception as e:
-        import traceback
-        import sys
         print(f"[Verifier] ❌ Error loading YOLO model: {e}", flush=True)
         print(f"[Verifier] Traceback: {traceback.format_exc()}", flush=True)
         print("[Verifier] ⚠️ Server will start but verification may not work properly", flush=True)
@@ -95,60 +244,528 @@ class VerifyResponse(BaseModel):
     classesDetected: List[ClassCount]
     confidence: float
     annotatedImagePath: Optional[str] = None
-    annotatedImage: Optional[str] = None  # Base64 encoded annotated image
+    annotatedImage: Optional[str] = None  # Base64 encoded annotated image (omitted when inline=false)
+    annotatedImageUrl: Optional[str] = None  # GET path serving the same JPEG
     knnVerification: Optional[Dict[str, Any]] = None  # KNN verification results
 
 
+# Failure result (no detections, nothing to show), serialized once and returned
+# as-is from the error paths instead of building/validating a model per request
+_FAILED_RESPONSE_BYTES = orjson.dumps(
+    VerifyResponse(pass_=False, count=0, classesDetected=[], confidence=0.0).model_dump()
+)
+
+
+def failed_response() -> Response:
+    """Prebuilt failed-verification response"""
+    return Response(content=_FAILED_RESPONSE_BYTES, media_type="application/json")
+
+
+def verify_json_response(response: VerifyResponse) -> Response:
+    """Serialize a /verify result directly, skipping FastAPI's response_model re-validation"""
+    return Response(content=orjson.dumps(response.model_dump()), media_type="application/json")
+
+
+# Recent passing results keyed on the upload bytes + request fields, so a retried or
+# double-tapped capture skips inference. Entries hold the base64 annotated image, hence the
+# small bound. Only touched from the event loop thread, so no lock.
+RESPONSE_CACHE_MAX_ENTRIES = 32
+RESPONSE_CACHE_TTL_SECONDS = 300
+_response_cache: "OrderedDict[bytes, Tuple[float, VerifyResponse]]" = OrderedDict()
+
+
+def response_cache_key(content, expected: str, annotate: bool, inline: bool) -> bytes:
+    """Digest of everything a /verify result depends on"""
+    h = hashlib.blake2b(content, digest_size=16)
+    h.update(b"\0" + expected.encode() + (b"\1" if annotate else b"\0") + (b"\1" if inline else b"\0"))
+    return h.digest()
+
+
+def get_cached_response(key: bytes) -> Optional[VerifyResponse]:
+    """Cached response for key, or None if absent/expired"""
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, response = entry
+    if time.monotonic() - stored_at > RESPONSE_CACHE_TTL_SECONDS:
+        del _response_cache[key]
+        return None
+    # server.js deletes or renames the annotated file once it has handled the response; a cached
+    # path/URL to a file that's gone would be useless, so re-run the verification instead
+    if response.annotatedImagePath and not os.path.exists(response.annotatedImagePath):
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return response
+
+
+def cache_response(key: bytes, response: VerifyResponse):
+    """Store response under key, evicting the least recently used entries over the bound"""
+    _response_cache[key] = (time.monotonic(), response)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+
+# Scratch buffers for the pre-inference letterbox, all YOLO_IMGSZ x YOLO_IMGSZ so any of them fits.
+# A buffer belongs to one request until its inference batch has run, so it's a pool rather
+# than a single shared array.
+_resize_buffer_pool: List["np.ndarray"] = []
+_resize_buffer_lock = threading.Lock()
+
+
+def letterbox_into_buffer(img, size=YOLO_IMGSZ):
+    """Aspect-preserving resize of img into a pooled size x size buffer, padded with YOLO's grey (114).
+
+    Returns (buf, ratio, pad_x, pad_y); a box in buf maps back with (x - pad_x) / ratio.
+    Hand buf back with release_resize_buffer once inference is done.
+    """
+    height, width = img.shape[:2]
+    ratio = size / max(height, width)
+    new_width = min(size, round(width * ratio))
+    new_height = min(size, round(height * ratio))
+    pad_x = (size - new_width) // 2
+    pad_y = (size - new_height) // 2
+
+    with _resize_buffer_lock:
+        buf = _resize_buffer_pool.pop() if _resize_buffer_pool else None
+    if buf is None:
+        buf = np.empty((size, size, 3), dtype=np.uint8)
+    # Resize straight into the centre of the buffer (same interpolation as Ultralytics' LetterBox),
+    # then fill only the borders
+    cv2.resize(img, (new_width, new_height), dst=buf[pad_y:pad_y + new_height, pad_x:pad_x + new_width],
+               interpolation=cv2.INTER_LINEAR)
+    buf[:pad_y] = 114
+    buf[pad_y + new_height:] = 114
+    buf[:, :pad_x] = 114
+    buf[:, pad_x + new_width:] = 114
+    return buf, ratio, pad_x, pad_y
+
+
+def release_resize_buffer(buf):
+    """Return a buffer from letterbox_into_buffer to the pool"""
+    with _resize_buffer_lock:
+        if len(_resize_buffer_pool) < INFERENCE_BATCH_MAX_IMAGES:
+            _resize_buffer_pool.append(buf)
+
+
+def predict_batch(images):
+    """Run the YOLO model on a list of letterboxed frames with the verifier's inference settings"""
+    # The confidence cut happens in the predictor; area/aspect/duplicate filtering in post-processing.
+    # iou: IoU threshold for NMS (0.4 = slightly more aggressive to remove overlapping detections)
+    # batch: tells the OpenVINO backend to compile for throughput (multi-image batches, async infer queue)
+    return yolo_model(images, conf=DETECTION_MIN_CONFIDENCE, iou=0.4, imgsz=YOLO_IMGSZ,
+                      device=yolo_device, half=yolo_half, batch=INFERENCE_BATCH_MAX_IMAGES, verbose=False)
+
+
+async def inference_batch_worker():
+    """Coalesce queued images into batched YOLO calls and resolve each request's future"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _inference_queue.get()]
+        deadline = loop.time() + INFERENCE_BATCH_WINDOW
+        while len(batch) < INFERENCE_BATCH_MAX_IMAGES:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_inference_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        images = [img for img, _ in batch]
+        try:
+            # Run off the event loop so requests keep decoding/preprocessing while the model runs
+            results = await run_in_threadpool(predict_batch, images)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+async def run_cpu(fn, *args):
+    """Run a CPU-bound request step on the verifier's CPU pool"""
+    return await asyncio.get_running_loop().run_in_executor(_cpu_executor, fn, *args)
+
+
+async def run_inference(img):
+    """Queue img for the next inference batch and wait for its result"""
+    fut = asyncio.get_running_loop().create_future()
+    await _inference_queue.put((img, fut))
+    return await fut
+
+
+def suppress_duplicates(boxes, iou_threshold):
+    """Greedy IoU suppression over confidence-sorted (x1, y1, x2, y2) boxes.
+
+    Returns the indices of the boxes to keep. The pairwise IoU matrix is computed in one
+    NumPy pass instead of a Python call per pair.
+    """
+    if not boxes:
+        return []
+    b = np.asarray(boxes, dtype=np.float32)
+    areas = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    iw = np.clip(np.minimum(b[:, None, 2], b[None, :, 2]) - np.maximum(b[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(b[:, None, 3], b[None, :, 3]) - np.maximum(b[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = areas[:, None] + areas[None, :] - inter
+    iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+    suppressed = np.zeros(len(b), dtype=bool)
+    keep = []
+    for i in range(len(b)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_threshold
+    return keep
+
+
+def encode_jpeg(img_bgr, quality=95) -> bytes:
+    """JPEG-encode a BGR frame with OpenCV"""
+    # img_bgr is in BGR, which is the channel order imencode expects
+    ok, buffer = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+def save_annotated_image(annotated_img_bgr, inline=True):
+    """Save annotated image to backend captures directory and (if inline) encode as base64.
+
+    Runs on a CPU pool thread, so the file is written before the response goes out: server.js copies
+    annotatedImagePath as soon as it gets the response, and /annotated/ serves it.
+    Returns (annotated_path, annotated_image_base64); either may be None on failure.
+    """
+    annotated_path = None
+    annotated_image_base64 = None
+    try:
+        annotated_filename = f"annotated_{int(time.time() * 1000)}_{next(_annotated_seq)}.jpg"
+        annotated_path = str(CAPTURES_DIR / annotated_filename)
+        # Encode once with high quality JPEG (95/100) to preserve image clarity; the same
+        # bytes go to disk and into the response.
+        jpeg_bytes = encode_jpeg(annotated_img_bgr, quality=95)
+        # Write under a temp name and rename, so readers never see a half-written JPEG
+        partial_path = annotated_path + ".part"
+        Path(partial_path).write_bytes(jpeg_bytes)
+        os.replace(partial_path, annotated_path)
+        logger.debug("[YOLO DEBUG] Annotated image saved to: %s (quality: 95/100)", annotated_path)
+
+        if inline:
+            # Base64 of the same JPEG for inclusion in response
+            annotated_image_base64 = base64.b64encode(jpeg_bytes).decode('ascii')
+            logger.debug("[YOLO DEBUG] Annotated image encoded as base64 (size: %d bytes)", len(annotated_image_base64))
+    except Exception as e:
+        logger.warning("[YOLO] Failed to save/encode annotated image: %s", e)
+    return annotated_path, annotated_image_base64
+
+
+def annotated_image_url(annotated_path: Optional[str]) -> Optional[str]:
+    """GET /annotated/ path for a saved annotated image"""
+    return f"/annotated/{Path(annotated_path).name}" if annotated_path else None
+
+
+def decode_image(content):
+    """Decode uploaded image bytes to a BGR array (None if not a decodable image)"""
+    return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def evaluate_detections(results, img_original_bgr, ratio, pad_x, pad_y,
+                        expected_count: int, expected_label: Optional[str], annotate: bool,
+                        inline: bool) -> VerifyResponse:
+    """Turn raw YOLO results for one letterboxed frame into the /verify response.
+
+    Maps boxes back to original-image coordinates, applies the quality filter and duplicate
+    suppression, optionally annotates and saves the frame, and applies the pill type/count checks.
+    CPU-bound: called through run_cpu so it stays off the event loop.
+    """
+    # Process detection results and filter duplicates
+
+    all_detections: List[Dict[str, Any]] = []
+    # Per-box detail is only worth building when DEBUG is actually on; checked once per request
+    debug_boxes = logger.isEnabledFor(logging.DEBUG)
+
+    logger.debug("[YOLO DEBUG] Number of result objects: %d", len(results))
+
+    for result in results:
+        boxes = result.boxes
+        if boxes is not None:
+            logger.debug("[YOLO DEBUG] Number of boxes: %d", len(boxes))
+            # One device->host transfer per tensor instead of three scalar syncs per box
+            cls_ids = boxes.cls.cpu().numpy().astype(np.int64)
+            confs = boxes.conf.cpu().numpy().astype(np.float64)
+            xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
+            # Map boxes from the letterboxed frame back to original image coordinates, all at once
+            xyxy[:, [0, 2]] -= pad_x
+            xyxy[:, [1, 3]] -= pad_y
+            xyxy /= ratio
+            # Detection area and aspect ratio for quality filtering
+            widths = xyxy[:, 2] - xyxy[:, 0]
+            heights = xyxy[:, 3] - xyxy[:, 1]
+            areas = widths * heights
+            aspect_ratios = np.divide(widths, heights, out=np.ones_like(widths), where=heights > 0)
+            # Quality filter as one boolean mask, so rejected boxes never become dicts
+            quality_mask = ((areas >= DETECTION_MIN_AREA)
+                            & (aspect_ratios >= DETECTION_MIN_ASPECT_RATIO)
+                            & (aspect_ratios <= DETECTION_MAX_ASPECT_RATIO))
+            logger.debug("[YOLO DEBUG] Quality filtering: %d -> %d detections", len(quality_mask), int(quality_mask.sum()))
+            cls_ids, confs, xyxy = cls_ids[quality_mask], confs[quality_mask], xyxy[quality_mask]
+            areas, aspect_ratios = areas[quality_mask], aspect_ratios[quality_mask]
+            # Resolve the class-name table once per result rather than per box
+            names = getattr(result, 'names', None) or {}
+            for cls_id, conf, box, area, aspect_ratio in zip(cls_ids.tolist(), confs.tolist(), xyxy.tolist(),
+                                                              areas.tolist(), aspect_ratios.tolist()):
+                # Get class name from model
+                class_name = names.get(cls_id) or f"pill_{cls_id}"
+
+                all_detections.append({
+                    'class_name': class_name,
+                    'confidence': conf,
+                    'box': tuple(box),
+                    'area': area,
+                    'aspect_ratio': aspect_ratio
+                })
+        else:
+            logger.debug("[YOLO DEBUG] No boxes found in result")
+
+    if debug_boxes:
+        logger.debug("[YOLO DEBUG] Detections: %s", ", ".join(
+            "%s conf=%.3f box=(%.1f,%.1f,%.1f,%.1f) area=%.0f" % (det['class_name'], det['confidence'], *det['box'], det['area'])
+            for det in all_detections))
+
+    # Empty frame (common "no pills present" case) or nothing passed the quality filter:
+    # nothing to dedup, count or draw. Zero detections can never pass, so skip straight to the response.
+    if not all_detections:
+        logger.debug("[YOLO DEBUG] No detections - returning empty result")
+        annotated_path, annotated_image_base64 = (
+            save_annotated_image(img_original_bgr, inline) if annotate else (None, None)
+        )
+        return VerifyResponse.model_construct(
+            pass_=False,
+            count=0,
+            classesDetected=[],
+            confidence=0.0,
+            annotatedImagePath=annotated_path,
+            annotatedImage=annotated_image_base64,
+            annotatedImageUrl=annotated_image_url(annotated_path),
+            knnVerification=None,
+        )
+
+    # Sort by confidence (highest first)
+    all_detections.sort(key=lambda x: x['confidence'], reverse=True)
+
+    # Remove overlapping detections (keep highest confidence)
+    # Use more aggressive IoU threshold for better duplicate removal
+    # Class-agnostic on purpose: YOLO's NMS is per-class, so two labels on one pill survive it
+    keep = suppress_duplicates([det['box'] for det in all_detections], iou_threshold=0.4)
+    filtered_detections = [all_detections[i] for i in keep]
+
+    logger.debug("[YOLO DEBUG] Filtered from %d to %d detections", len(all_detections), len(filtered_detections))
+
+    # Count detections by class after filtering
+
+    detections_by_class = Counter(det['class_name'] for det in filtered_detections)
+
+    logger.debug("[YOLO DEBUG] Total detections after filtering: %d", len(filtered_detections))
+    logger.debug("[YOLO DEBUG] Detections by class: %s", detections_by_class)
+
+    # Convert to ClassCount format
+
+    detected_count = len(filtered_detections)
+    # Built from values already typed here, so the models are constructed without validation
+    detected_classes = [ClassCount.model_construct(label=label, n=count) for label, count in detections_by_class.items()]
+
+    # Calculate weighted average confidence (weighted by detection area)
+    # Larger detections are more reliable, so weight them more
+    confs = np.fromiter((det['confidence'] for det in filtered_detections), dtype=np.float64,
+                        count=len(filtered_detections))
+    areas = np.fromiter((det['area'] for det in filtered_detections), dtype=np.float64,
+                        count=len(filtered_detections))
+    total_area = areas.sum()
+    confidence = float(np.dot(confs, areas) / total_area) if total_area > 0 else float(confs.mean())
+    logger.debug("[YOLO DEBUG] Weighted average confidence: %.3f", confidence)
+
+    annotated_path = None
+    annotated_image_base64 = None
+    if annotate:
+        # Draw bounding boxes and labels on the image (using filtered detections)
+        # Use original image in BGR format for OpenCV drawing functions
+        # OpenCV drawing functions (rectangle, putText) require BGR format
+        # The frame stays BGR through encode_jpeg, which is the order cv2.imencode expects
+        # Draw straight onto the decoded frame: it isn't used again after this, so no copy
+        annotated_img_bgr = img_original_bgr
+        # Track count per class for labeling
+
+        class_counts = Counter()
+        boxes_int = [[int(coord) for coord in det['box']] for det in filtered_detections]
+
+        # Draw all bounding boxes in one call (OpenCV expects BGR, so (0, 255, 0) = green in BGR)
+        box_outlines = np.array([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes_int],
+                                dtype=np.int32)
+        cv2.polylines(annotated_img_bgr, box_outlines, True, (0, 255, 0), 2)
+
+        for det, (x1, y1, x2, y2) in zip(filtered_detections, boxes_int):
+            class_name = det['class_name']
+            conf = det['confidence']
+
+            # Count occurrences of this class
+            class_counts[class_name] += 1
+            current_count = class_counts[class_name]
+
+            # Prepare label text with count - make it bigger and more readable
+            label = f"{class_name} ({current_count}) {conf:.2f}"
+
+            # Use larger font size for better visibility
+            font_scale = 1.2  # Increased from 0.6 to 1.2
+            font_thickness = 3  # Increased from 2 to 3 for better visibility
+
+            # Get text size for background
+            (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
+
+            # Draw label background with padding
+            padding = 8
+            cv2.rectangle(annotated_img_bgr, 
+                         (x1 - padding, y1 - text_height - padding - 5), 
+                         (x1 + text_width + padding, y1 + padding), 
+                         (0, 255, 0), -1)
+
+            # Draw label text with larger font
+            cv2.putText(annotated_img_bgr, label, (x1, y1 - padding), 
+                       cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), font_thickness)
+
+        # Add total count text at top of image - make it bigger
+        total_text = f"Total Pills: {detected_count}"
+        total_font_scale = 1.5  # Increased from 0.8 to 1.5
+        total_font_thickness = 4  # Increased from 2 to 4
+        (total_text_width, total_text_height), _ = cv2.getTextSize(total_text, cv2.FONT_HERSHEY_SIMPLEX, total_font_scale, total_font_thickness)
+        # Draw background for total count with padding
+        padding = 10
+        cv2.rectangle(annotated_img_bgr, 
+                     (padding, padding), 
+                     (padding + total_text_width + padding, padding + total_text_height + padding), 
+                     (0, 255, 0), -1)
+        # Draw total count text with larger font
+        cv2.putText(annotated_img_bgr, total_text, (padding + 5, padding + total_text_height), 
+                   cv2.FONT_HERSHEY_SIMPLEX, total_font_scale, (0, 0, 0), total_font_thickness)
+
+        # Save annotated image to backend captures directory and encode as base64
+        annotated_path, annotated_image_base64 = save_annotated_image(annotated_img_bgr, inline)
+
+    # Determine if verification passes
+    # PillNow requirement: alert when pill TYPE is wrong OR pill COUNT is wrong.
+    # IMPORTANT: If container should have ONLY one type of pill, ANY foreign pill = MISMATCH
+    confidence_threshold = 0.4  # Higher threshold for verification (ensures quality detections)
+
+    # Initialize pass_ based on confidence and basic detection
+    pass_ = detected_count > 0 and confidence >= confidence_threshold
+
+    # Pill type + count validation
+    if expected_label:
+        # Lowercase each detected label once; every check below compares against expected_label
+        labels_lc = [c.label.lower() for c in detected_classes]
+        detected_labels = set(labels_lc)
+        # Get count of expected type pills vs foreign type pills
+        expected_type_count = sum(c.n for c, lc in zip(detected_classes, labels_lc) if lc == expected_label)
+        foreign_type_count = sum(c.n for c in detected_classes) - expected_type_count
+        foreign_types = [c.label for c, lc in zip(detected_classes, labels_lc) if lc != expected_label]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[YOLO DEBUG] ========== PILL TYPE CHECK ==========")
+            logger.debug("   Expected label (lowercase): '%s'", expected_label)
+            logger.debug("   Expected count: %d", expected_count)
+            logger.debug("   Detected labels (lowercase): %s", detected_labels)
+            logger.debug("   Detected classes: %s", [(c.label, c.n) for c in detected_classes])
+            logger.debug("   Pills of expected type: %d", expected_type_count)
+            logger.debug("   Foreign pills detected: %d (%s)", foreign_type_count, foreign_types)
+
+        # Check 1: No foreign pill types allowed in container
+        has_foreign_pills = foreign_type_count > 0
+
+        # Check 2: Expected pill type must exist
+        has_expected_type = expected_label in detected_labels
+
+        # Check 3: Count of expected type pills should match (if count specified)
+        count_match = (expected_type_count == expected_count) if expected_count > 0 else True
+
+        if has_foreign_pills:
+            logger.info("[YOLO] ❌ FOREIGN PILL TYPE DETECTED: container should only have '%s' but found %s (count: %d)",
+                        expected_label, foreign_types, foreign_type_count)
+            pass_ = False  # Foreign pill type = fail, trigger alert
+        elif not has_expected_type:
+            logger.info("[YOLO] ❌ EXPECTED PILL TYPE NOT FOUND: expected '%s' but got %s", expected_label, detected_labels)
+            pass_ = False  # Expected pill type not found = fail
+        elif not count_match:
+            logger.info("[YOLO] ❌ PILL COUNT MISMATCH: expected %d x '%s' but detected %d",
+                        expected_count, expected_label, expected_type_count)
+            pass_ = False  # Wrong count = fail, trigger alert
+        else:
+            logger.debug("[YOLO DEBUG] ✅ PILL TYPE + COUNT MATCH: '%s' x %d, no foreign pills", expected_label, expected_count)
+            pass_ = True  # Only set to True if all checks pass
+    else:
+        # No expected label provided - use count/confidence check
+        logger.debug("[YOLO DEBUG] No expected label provided - using count/confidence check")
+        count_match = (detected_count == expected_count) if expected_count > 0 else True
+        pass_ = count_match and confidence >= confidence_threshold
+        logger.debug("[YOLO DEBUG] Count/confidence check: count_match=%s, confidence=%.2f", count_match, confidence)
+
+    logger.info("[YOLO] Result: pass_=%s detected_count=%d expected_count=%d confidence=%.2f",
+                pass_, detected_count, expected_count, confidence)
+
+    # Return YOLO-only verification result
+    response = VerifyResponse.model_construct(
+        pass_=pass_,
+        count=detected_count,
+        classesDetected=detected_classes,
+        confidence=confidence,
+        annotatedImagePath=annotated_path,
+        annotatedImage=annotated_image_base64,
+        annotatedImageUrl=annotated_image_url(annotated_path),
+        knnVerification=None,
+    )
+    return response
+
+
 @app.post("/verify", response_model=VerifyResponse)
-async def verify(image: UploadFile = File(...), expected: str = Form("{}")):
-    """Verify pills in an image using YOLO model"""
+async def verify(image: UploadFile = File(...), expected: str = Form("{}"), annotate: bool = Form(True),
+                 inline: bool = Form(True)):
+    """Verify pills in an image using YOLO model
+
+    annotate=false skips drawing, saving and encoding the annotated image (annotatedImage/Path/Url are null).
+    inline=false leaves the base64 annotatedImage out; fetch annotatedImageUrl instead.
+    """
     try:
         try:
-            expected_obj: Dict[str, Any] = json.loads(expected) if expected else {}
-        except json.JSONDecodeError:
+            expected_obj: Dict[str, Any] = orjson.loads(expected) if expected else {}
+        except orjson.JSONDecodeError:
             raise HTTPException(status_code=400, detail="expected must be JSON string")
         except Exception as e:
-            print(f"[VERIFY] Error parsing request: {e}")
+            logger.warning("[VERIFY] Error parsing request: %s", e)
             raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
 
         # Load image into memory
         content = await image.read()
+
+        cache_key = response_cache_key(content, expected, annotate, inline)
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            logger.debug("[VERIFY] Returning cached result for identical upload")
+            return verify_json_response(cached)
+
         try:
-            # Load image preserving original color profile and brightness
-            img_pil = Image.open(BytesIO(content))
-            # Convert to RGB if needed, but preserve original appearance
-            if img_pil.mode != 'RGB':
-                img_pil = img_pil.convert("RGB")
-            # Convert PIL to OpenCV format (numpy array)
-            # Keep in RGB format for original (preserves brightness)
-            img_np_rgb = np.array(img_pil, dtype=np.uint8)
-            
-            # Store original image in RGB format (preserves original brightness)
-            img_original_rgb = img_np_rgb.copy()
-            
-            # Convert to BGR only for OpenCV processing
-            img_cv = cv2.cvtColor(img_np_rgb, cv2.COLOR_RGB2BGR)
+            # Decode straight into OpenCV's native BGR layout (no PIL buffer, no RGB->BGR copy),
+            # on the CPU pool: a multi-MP JPEG decode would otherwise stall every other request
+            img_cv = await run_cpu(decode_image, content)
+            # Encoded bytes aren't needed once decoded; release them before inference
+            del content
+            if img_cv is None:
+                raise ValueError("could not decode image data")
             
-            # Image preprocessing for better detection accuracy
-            # 1. Enhance contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
-            # Reduced clipLimit to prevent over-darkening
-            lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))  # Reduced from 2.0 to prevent darkening
-            l = clahe.apply(l)
-            img_cv = cv2.merge([l, a, b])
-            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_LAB2BGR)
-            
-            # 2. Apply slight sharpening to enhance edges (reduced intensity)
-            kernel = np.array([[-1, -1, -1],
-                             [-1,  9, -1],
-                             [-1, -1, -1]])
-            img_cv = cv2.filter2D(img_cv, -1, kernel * 0.05)  # Reduced from 0.1 to prevent artifacts
-            
-            # 3. Denoise to reduce false positives (lighter denoising)
-            img_cv = cv2.bilateralFilter(img_cv, 3, 30, 30)  # Reduced parameters for less blur
-            
-            print(f"[YOLO DEBUG] Image preprocessing applied: CLAHE contrast enhancement (reduced), sharpening (reduced), denoising (lighter)")
+            # Annotation draws on the decoded frame; the model gets a letterboxed copy
+            img_original_bgr = img_cv
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"invalid image: {str(e)}")
 
@@ -161,18 +778,18 @@ async def verify(image: UploadFile = File(...), expected: str = Form("{}")):
             except Exception:
                 expected_count = 0
         # Optional expected pill label/type (use any of these keys)
-        print(f"[YOLO DEBUG] Raw expected_obj: {expected_obj}")
+        logger.debug("[YOLO DEBUG] Raw expected_obj: %s", expected_obj)
         if isinstance(expected_obj, dict):
             expected_label = expected_obj.get("label") or expected_obj.get("pill") or expected_obj.get("pillType") or expected_obj.get("pill_name")
-            print(f"[YOLO DEBUG] Extracted expected_label (before processing): {expected_label}")
+            logger.debug("[YOLO DEBUG] Extracted expected_label (before processing): %s", expected_label)
             if expected_label:
                 expected_label_original = str(expected_label).strip()
                 expected_label = expected_label_original.lower()
-                print(f"[YOLO DEBUG] ✅ Expected pill label received: '{expected_label_original}' -> normalized to: '{expected_label}'")
+                logger.debug("[YOLO DEBUG] ✅ Expected pill label received: '%s' -> normalized to: '%s'", expected_label_original, expected_label)
             else:
-                print(f"[YOLO DEBUG] ⚠️ No expected label found in expected_obj. Keys available: {list(expected_obj.keys())}")
+                logger.debug("[YOLO DEBUG] ⚠️ No expected label found in expected_obj. Keys available: %s", list(expected_obj))
         else:
-            print(f"[YOLO DEBUG] ⚠️ expected_obj is not a dict, type: {type(expected_obj)}")
+            logger.debug("[YOLO DEBUG] ⚠️ expected_obj is not a dict, type: %s", type(expected_obj))
 
         # Mock verifier mode: return deterministic, fast response for CI and local dev
         if MOCK_VERIFIER:
@@ -194,400 +811,62 @@ async def verify(image: UploadFile = File(...), expected: str = Form("{}")):
             )
 
         # Run inference with YOLOv8 model
-        detected_classes: List[ClassCount] = []
-        detected_count = 0
-        confidence = 0.0
-        pass_ = False
-        annotated_path = None
-
         try:
             if yolo_model is None:
                 raise Exception("YOLOv8 model not loaded")
 
-            # Debug: Print model class names
-
             if hasattr(yolo_model, 'names'):
-                print(f"[YOLO DEBUG] Model classes: {yolo_model.names}")
+                logger.debug("[YOLO DEBUG] Model classes: %s", yolo_model.names)
 
-            # Run YOLOv8 detection with optimized parameters for higher accuracy
-            # Using lower confidence threshold initially to catch all potential detections,
-            # then filtering more aggressively in post-processing
-            
-            # conf: confidence threshold (0.25 = lower to catch more pills, filter later)
-            # iou: IoU threshold for NMS (0.4 = slightly more aggressive to remove overlapping detections)
-            # imgsz: Use optimal image size (640 is YOLOv8 default, but can be adjusted)
-            # verbose: print detailed detection info
-            
-            # Get optimal image size (YOLOv8 works best with multiples of 32)
+            # Letterbox to the model input size here, once, on the CPU: a 12 MP phone frame becomes
+            # a 640x640 array before it's queued, so the predictor only gets model-sized input
             original_height, original_width = img_cv.shape[:2]
-            optimal_size = 640  # YOLOv8 default, good balance of speed and accuracy
-            
-            # Initialize scale factors (default to 1.0 if no resizing)
-            scale_x = 1.0
-            scale_y = 1.0
-            
-            # Resize if image is too large or too small (maintains aspect ratio)
-            if max(original_width, original_height) > 1280:
-                scale = 1280 / max(original_width, original_height)
-                new_width = int(original_width * scale)
-                new_height = int(original_height * scale)
-                # Round to nearest multiple of 32 for optimal YOLO performance
-                new_width = (new_width // 32) * 32
-                new_height = (new_height // 32) * 32
-                img_cv_resized = cv2.resize(img_cv, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-                # Calculate scale factors for coordinate mapping
-                scale_x = original_width / new_width
-                scale_y = original_height / new_height
-                print(f"[YOLO DEBUG] Resized image from {original_width}x{original_height} to {new_width}x{new_height} for optimal detection (scale: {scale_x:.3f}x, {scale_y:.3f}y)")
-            else:
-                img_cv_resized = img_cv
-            
-            # Run detection with optimized parameters
-            results = yolo_model(img_cv_resized, conf=0.25, iou=0.4, imgsz=optimal_size, verbose=False)
-            
-            # Scale detection boxes back to original image size if resized
-            scale_x = original_width / img_cv_resized.shape[1] if img_cv_resized.shape[1] != original_width else 1.0
-            scale_y = original_height / img_cv_resized.shape[0] if img_cv_resized.shape[0] != original_height else 1.0
-
-            # Process detection results and filter duplicates
-
-            all_detections: List[Dict[str, Any]] = []
-
-            print(f"[YOLO DEBUG] Number of result objects: {len(results)}")
-
-            for result in results:
-                boxes = result.boxes
-                print(f"[YOLO DEBUG] Boxes object: {boxes}")
-                if boxes is not None:
-                    print(f"[YOLO DEBUG] Number of boxes: {len(boxes)}")
-                    for box in boxes:
-                        # Get class ID and confidence
-                        cls_id = int(box.cls[0])
-                        conf = float(box.conf[0])
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(float)
-                        
-                        # Scale boxes back to original image size if image was resized
-                        x1 = x1 * scale_x
-                        y1 = y1 * scale_y
-                        x2 = x2 * scale_x
-                        y2 = y2 * scale_y
-                        
-                        # Get class name from model
-                        class_name = result.names[cls_id] if hasattr(result, 'names') else f"pill_{cls_id}"
-                        
-                        # Calculate detection area and aspect ratio for quality filtering
-                        area = (x2 - x1) * (y2 - y1)
-                        aspect_ratio = (x2 - x1) / (y2 - y1) if (y2 - y1) > 0 else 1.0
-                        
-                        print(f"[YOLO DEBUG] Detected: class={class_name} (id={cls_id}), confidence={conf:.3f}, box=({x1:.1f},{y1:.1f},{x2:.1f},{y2:.1f}), area={area:.0f}")
-
-                        all_detections.append({
-                            'class_name': class_name,
-                            'confidence': conf,
-                            'box': (x1, y1, x2, y2),
-                            'area': area,
-                            'aspect_ratio': aspect_ratio
-                        })
-                else:
-                    print(f"[YOLO DEBUG] No boxes found in result")
-
-            # Filter overlapping detections (likely duplicates of the same pill)
-
-            def calculate_iou(box1, box2):
-                """Calculate Intersection over Union (IoU) of two boxes"""
-                x1_1, y1_1, x2_1, y2_1 = box1
-                x1_2, y1_2, x2_2, y2_2 = box2
-
-                # Calculate intersection
-                x1_i = max(x1_1, x1_2)
-                y1_i = max(y1_1, y1_2)
-                x2_i = min(x2_1, x2_2)
-                y2_i = min(y2_1, y2_2)
-
-                if x2_i <= x1_i or y2_i <= y1_i:
-                    return 0.0
-
-                intersection = (x2_i - x1_i) * (y2_i - y1_i)
-                area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-                area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-                union = area1 + area2 - intersection
-
-                return intersection / union if union > 0 else 0.0
-
-            # Filter detections by quality criteria before duplicate removal
-            # 1. Minimum confidence threshold (higher than initial detection threshold)
-            min_confidence = 0.35  # Higher threshold for final detections
-            # 2. Minimum area (filter out very small detections that are likely false positives)
-            min_area = 100  # Minimum pixel area for a valid detection
-            # 3. Reasonable aspect ratio (pills are roughly circular/oval, not extremely elongated)
-            min_aspect_ratio = 0.3
-            max_aspect_ratio = 3.0
-            
-            quality_filtered = []
-            for det in all_detections:
-                if det['confidence'] < min_confidence:
-                    print(f"[YOLO DEBUG] Filtering low confidence: {det['class_name']} (conf={det['confidence']:.3f} < {min_confidence})")
-                    continue
-                if det['area'] < min_area:
-                    print(f"[YOLO DEBUG] Filtering small detection: {det['class_name']} (area={det['area']:.0f} < {min_area})")
-                    continue
-                if not (min_aspect_ratio <= det['aspect_ratio'] <= max_aspect_ratio):
-                    print(f"[YOLO DEBUG] Filtering invalid aspect ratio: {det['class_name']} (ratio={det['aspect_ratio']:.2f})")
-                    continue
-                quality_filtered.append(det)
-            
-            print(f"[YOLO DEBUG] Quality filtering: {len(all_detections)} -> {len(quality_filtered)} detections")
-            
-            # Sort by confidence (highest first)
-            quality_filtered.sort(key=lambda x: x['confidence'], reverse=True)
-
-            # Remove overlapping detections (keep highest confidence)
-            # Use more aggressive IoU threshold for better duplicate removal
-            filtered_detections = []
-            for det in quality_filtered:
-                is_duplicate = False
-                for existing in filtered_detections:
-                    iou = calculate_iou(det['box'], existing['box'])
-                    # More aggressive duplicate filtering: 40% overlap threshold
-                    if iou > 0.4:
-                        print(f"[YOLO DEBUG] Filtering duplicate: {det['class_name']} (conf={det['confidence']:.3f}) overlaps with {existing['class_name']} (conf={existing['confidence']:.3f}), IoU={iou:.3f}")
-                        is_duplicate = True
-                        break
-                if not is_duplicate:
-                    filtered_detections.append(det)
-
-            print(f"[YOLO DEBUG] Filtered from {len(all_detections)} to {len(filtered_detections)} detections")
-
-            # Count detections by class after filtering
-
-            detections_by_class: Dict[str, int] = {}
-            all_confidences: List[float] = []
-
-            for det in filtered_detections:
-                class_name = det['class_name']
-                conf = det['confidence']
-                all_confidences.append(conf)
-
-                if class_name in detections_by_class:
-                    detections_by_class[class_name] += 1
-                else:
-                    detections_by_class[class_name] = 1
-
-            print(f"[YOLO DEBUG] Total detections after filtering: {sum(detections_by_class.values())}")
-            print(f"[YOLO DEBUG] Detections by class: {detections_by_class}")
-
-            # Convert to ClassCount format
-
-            detected_count = sum(detections_by_class.values())
-            for label, count in detections_by_class.items():
-                detected_classes.append(ClassCount(label=label, n=count))
-                print(f"[YOLO DEBUG] Detected class: '{label}' (count: {count})")
-
-            # Calculate weighted average confidence (weighted by detection area)
-            # Larger detections are more reliable, so weight them more
-            if all_confidences:
-                total_weighted_confidence = sum(det['confidence'] * det['area'] for det in filtered_detections)
-                total_area = sum(det['area'] for det in filtered_detections)
-                confidence = total_weighted_confidence / total_area if total_area > 0 else np.mean(all_confidences)
-            else:
-                confidence = 0.0
-            print(f"[YOLO DEBUG] Weighted average confidence: {confidence:.3f}")
-
-            # Draw bounding boxes and labels on the image (using filtered detections)
-            # Use original image in BGR format for OpenCV drawing functions
-            # OpenCV drawing functions (rectangle, putText) require BGR format
-            # We'll convert back to RGB at the end for web display
-            annotated_img_bgr = cv2.cvtColor(img_original_rgb, cv2.COLOR_RGB2BGR)  # Convert to BGR for drawing
-            # Track count per class for labeling
-
-            class_counts = {}
-            for det in filtered_detections:
-                x1, y1, x2, y2 = [int(coord) for coord in det['box']]
-                class_name = det['class_name']
-                conf = det['confidence']
-
-                # Count occurrences of this class
-                if class_name not in class_counts:
-                    class_counts[class_name] = 0
-                class_counts[class_name] += 1
-                current_count = class_counts[class_name]
-
-                # Draw bounding box (OpenCV expects BGR, so (0, 255, 0) = green in BGR)
-                cv2.rectangle(annotated_img_bgr, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-                # Prepare label text with count - make it bigger and more readable
-                label = f"{class_name} ({current_count}) {conf:.2f}"
-
-                # Use larger font size for better visibility
-                font_scale = 1.2  # Increased from 0.6 to 1.2
-                font_thickness = 3  # Increased from 2 to 3 for better visibility
-                
-                # Get text size for background
-                (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-
-                # Draw label background with padding
-                padding = 8
-                cv2.rectangle(annotated_img_bgr, 
-                             (x1 - padding, y1 - text_height - padding - 5), 
-                             (x1 + text_width + padding, y1 + padding), 
-                             (0, 255, 0), -1)
-
-                # Draw label text with larger font
-                cv2.putText(annotated_img_bgr, label, (x1, y1 - padding), 
-                           cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), font_thickness)
-
-            # Add total count text at top of image - make it bigger
-            if detected_count > 0:
-                total_text = f"Total Pills: {detected_count}"
-                total_font_scale = 1.5  # Increased from 0.8 to 1.5
-                total_font_thickness = 4  # Increased from 2 to 4
-                (total_text_width, total_text_height), _ = cv2.getTextSize(total_text, cv2.FONT_HERSHEY_SIMPLEX, total_font_scale, total_font_thickness)
-                # Draw background for total count with padding
-                padding = 10
-                cv2.rectangle(annotated_img_bgr, 
-                             (padding, padding), 
-                             (padding + total_text_width + padding, padding + total_text_height + padding), 
-                             (0, 255, 0), -1)
-                # Draw total count text with larger font
-                cv2.putText(annotated_img_bgr, total_text, (padding + 5, padding + total_text_height), 
-                           cv2.FONT_HERSHEY_SIMPLEX, total_font_scale, (0, 0, 0), total_font_thickness)
-
-            # Save annotated image to backend captures directory and encode as base64
-            annotated_image_base64 = None
+            img_cv_resized, ratio, pad_x, pad_y = await run_cpu(letterbox_into_buffer, img_cv)
+            logger.debug("[YOLO DEBUG] Letterboxed image from %dx%d to %dx%d (ratio: %.3f, pad: %d,%d)",
+                         original_width, original_height, YOLO_IMGSZ, YOLO_IMGSZ, ratio, pad_x, pad_y)
+
+            # Run detection with optimized parameters (conf/iou/imgsz set in predict_batch)
             try:
-                # Save to backend/captures directory (one level up from verifier)
-                captures_dir = Path(__file__).parent.parent / "captures"
-                captures_dir.mkdir(exist_ok=True)
-                annotated_filename = f"annotated_{int(time.time() * 1000)}.jpg"
-                annotated_path = str(captures_dir / annotated_filename)
-                # Save with high quality JPEG (95/100) to preserve image clarity
-                # annotated_img_bgr is already in BGR format (OpenCV's native format)
-                cv2.imwrite(annotated_path, annotated_img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
-                print(f"[YOLO DEBUG] Annotated image saved to: {annotated_path} (quality: 95/100)")
-                
-                # Encode annotated image as base64 for inclusion in response
-                # Convert BGR back to RGB for web display (browsers/mobile apps expect RGB)
-                annotated_img_rgb = cv2.cvtColor(annotated_img_bgr, cv2.COLOR_BGR2RGB)
-                # Use high quality JPEG encoding (95/100) to preserve image clarity
-                import base64
-                encode_params = [cv2.IMWRITE_JPEG_QUALITY, 95]  # High quality (0-100, 95 = very high quality)
-                # Encode RGB image for web display (browsers/mobile apps expect RGB)
-                _, buffer = cv2.imencode('.jpg', annotated_img_rgb, encode_params)
-                annotated_image_base64 = base64.b64encode(buffer).decode('utf-8')
-                print(f"[YOLO DEBUG] Annotated image encoded as base64 with high quality (95/100) (size: {len(annotated_image_base64)} bytes)")
-            except Exception as e:
-                print(f"[YOLO DEBUG] Failed to save/encode annotated image: {e}")
-            
-            # Determine if verification passes
-            # PillNow requirement: alert when pill TYPE is wrong OR pill COUNT is wrong.
-            # IMPORTANT: If container should have ONLY one type of pill, ANY foreign pill = MISMATCH
-            confidence_threshold = 0.4  # Higher threshold for verification (ensures quality detections)
-            
-            # Initialize pass_ based on confidence and basic detection
-            pass_ = detected_count > 0 and confidence >= confidence_threshold
-            
-            # Pill type + count validation
-            if expected_label:
-                detected_labels = {c.label.lower() for c in detected_classes}
-                # Get count of expected type pills vs foreign type pills
-                expected_type_count = sum(c.n for c in detected_classes if c.label.lower() == expected_label)
-                foreign_type_count = sum(c.n for c in detected_classes if c.label.lower() != expected_label)
-                foreign_types = [c.label for c in detected_classes if c.label.lower() != expected_label]
-                
-                print(f"[YOLO DEBUG] ========== PILL TYPE CHECK ==========")
-                print(f"   Expected label (lowercase): '{expected_label}'")
-                print(f"   Expected count: {expected_count}")
-                print(f"   Detected labels (lowercase): {detected_labels}")
-                print(f"   Detected classes: {[(c.label, c.n) for c in detected_classes]}")
-                print(f"   Pills of expected type: {expected_type_count}")
-                print(f"   Foreign pills detected: {foreign_type_count} ({foreign_types})")
-                
-                # Check 1: No foreign pill types allowed in container
-                has_foreign_pills = foreign_type_count > 0
-                
-                # Check 2: Expected pill type must exist
-                has_expected_type = expected_label in detected_labels
-                
-                # Check 3: Count of expected type pills should match (if count specified)
-                count_match = (expected_type_count == expected_count) if expected_count > 0 else True
-
-                if has_foreign_pills:
-                    print(f"[YOLO DEBUG] ❌❌❌ FOREIGN PILL TYPE DETECTED ❌❌❌")
-                    print(f"   Container should only have '{expected_label}'")
-                    print(f"   But found foreign pills: {foreign_types} (count: {foreign_type_count})")
-                    print(f"   This is a MISMATCH - wrong pill in container!")
-                    pass_ = False  # Foreign pill type = fail, trigger alert
-                elif not has_expected_type:
-                    print(f"[YOLO DEBUG] ❌❌❌ EXPECTED PILL TYPE NOT FOUND ❌❌❌")
-                    print(f"   Expected '{expected_label}' but got {detected_labels}")
-                    print(f"   Setting pass_ = False (will trigger buzzer alarm)")
-                    pass_ = False  # Expected pill type not found = fail
-                elif not count_match:
-                    print(f"[YOLO DEBUG] ❌❌❌ PILL COUNT MISMATCH ❌❌❌")
-                    print(f"   Expected {expected_count} x '{expected_label}' but detected {expected_type_count}")
-                    print(f"   Setting pass_ = False (will trigger buzzer alarm)")
-                    pass_ = False  # Wrong count = fail, trigger alert
-                else:
-                    print(f"[YOLO DEBUG] ✅✅✅ PILL TYPE + COUNT MATCH ✅✅✅")
-                    print(f"   Expected '{expected_label}' x {expected_count} - VERIFIED")
-                    print(f"   No foreign pills detected")
-                    pass_ = True  # Only set to True if all checks pass
-            else:
-                # No expected label provided - use count/confidence check
-                print(f"[YOLO DEBUG] No expected label provided - using count/confidence check")
-                count_match = (detected_count == expected_count) if expected_count > 0 else True
-                pass_ = count_match and confidence >= confidence_threshold
-                print(f"[YOLO DEBUG] Count/confidence check: count_match={count_match}, confidence={confidence:.2f}")
-            
-            print(f"[YOLO DEBUG] ========== FINAL RESULT ==========")
-            print(f"   pass_ = {pass_}")
-            print(f"   detected_count = {detected_count}")
-            print(f"   expected_count = {expected_count}")
-            print(f"   confidence = {confidence:.2f}")
-            print(f"   ==========================================")
-            
-            # Return YOLO-only verification result
-            return VerifyResponse(
-                pass_=pass_,
-                count=detected_count,
-                classesDetected=detected_classes,
-                confidence=float(confidence),
-                annotatedImagePath=annotated_path,
-                annotatedImage=annotated_image_base64,
-                knnVerification=None,
-            )
+                results = [await run_inference(img_cv_resized)]
+            finally:
+                release_resize_buffer(img_cv_resized)
+
+            response = await run_cpu(evaluate_detections, results, img_original_bgr, ratio, pad_x, pad_y,
+                                     expected_count, expected_label, annotate, inline)
+            # Only successful verifications are cached; a failure should be re-evaluated on retry
+            if response.pass_:
+                cache_response(cache_key, response)
+            return verify_json_response(response)
             
         except Exception as e:
-            import traceback
-            print(f"Error during inference: {e}")
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error during inference: %s", e)
             # Return failure result if inference fails
-            return VerifyResponse(
-                pass_=False,
-                count=0,
-                classesDetected=[],
-                confidence=0.0,
-                annotatedImagePath=None,
-                annotatedImage=None,
-                knnVerification=None,
-            )
+            return failed_response()
     except HTTPException:
         # Re-raise HTTP exceptions (they're already properly formatted)
         raise
     except Exception as e:
         # Catch any other unexpected errors and return a failure response
-        import traceback
-        print(f"[VERIFY] Unexpected error in verify endpoint: {e}")
-        print(f"[VERIFY] Traceback: {traceback.format_exc()}")
-        return VerifyResponse(
-            pass_=False,
-            count=0,
-            classesDetected=[],
-            confidence=0.0,
-            annotatedImagePath=None,
-            annotatedImage=None,
-            knnVerification=None,
-        )
+        logger.exception("[VERIFY] Unexpected error in verify endpoint: %s", e)
+        return failed_response()
+
+
+@app.get("/annotated/{filename}")
+async def get_annotated_image(filename: str):
+    """Serve an annotated image saved by /verify (the file named in annotatedImageUrl)"""
+    path = CAPTURES_DIR / filename
+    if Path(filename).name != filename or not filename.startswith("annotated_") or not path.is_file():
+        raise HTTPException(status_code=404, detail="annotated image not found")
+    # Each verification writes a new file, so a given name never changes content
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=3600"})
+
+
+@app.post("/cache/clear")
+async def clear_response_cache():
+    """Drop all cached /verify results"""
+    cleared = len(_response_cache)
+    _response_cache.clear()
+    return {"cleared": cleared}
 
 
 # Health check endpoints
@@ -606,6 +885,13 @@ async def health():
     """Health check endpoint"""
     return {"status": "healthy", "service": "PillNow Verifier"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 until then"""
+    if not models_ready:
+        return ORJSONResponse({"status": "starting", "service": "PillNow Verifier"}, status_code=503)
+    return {"status": "ready", "service": "PillNow Verifier"}
+
 
 
 